@@ -1,14 +1,85 @@
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
 from astropy.io import fits
 from astropy.wcs import WCS
 from astropy.wcs import utils as wcs_utils
 from astropy.visualization import simple_norm
 import matplotlib.patches as patches
+from matplotlib.collections import LineCollection, PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import constellation_data
 
+# The output figure is fitted inside FIGURE_MAX_SIZE inches at OUTPUT_DPI
+FIGURE_MAX_SIZE = (20, 15)
+OUTPUT_DPI = 150
+# Usable pixels at that size; larger images are decimated before imshow
+DISPLAY_MAX_WIDTH = FIGURE_MAX_SIZE[0] * OUTPUT_DPI
+DISPLAY_MAX_HEIGHT = FIGURE_MAX_SIZE[1] * OUTPUT_DPI
+
+def segment_distances(x1, y1, x2, y2, d1, d2, deg_per_pixel):
+    """
+    Angular and 3D length of each constellation segment.
+    x1, y1, x2, y2: endpoint pixel coordinates (arrays)
+    d1, d2: endpoint distances in ly, NaN where unknown
+    Returns (dist_deg, dist_ly); dist_ly is NaN where either distance is unknown.
+    """
+    dist_deg = np.hypot(x2 - x1, y2 - y1)
+    dist_deg *= deg_per_pixel
+
+    # Law of Cosines: c^2 = a^2 + b^2 - 2ab cos(C)
+    # C is the angular separation in radians
+    cos_theta = np.cos(np.deg2rad(dist_deg))
+    dist_ly = d1 * d1
+    dist_ly += d2 * d2
+    dist_ly -= 2 * d1 * d2 * cos_theta
+    np.sqrt(dist_ly, out=dist_ly)
+    return dist_deg, dist_ly
+
+def add_label_backgrounds(ax, labels):
+    """
+    Draw the dark boxes behind text labels, batched into PatchCollections.
+    labels: list of (Text artist, pad in points, alpha), in drawing order
+    Like a per-text bbox, a later label's box covers any earlier label it
+    overlaps: each label goes one layer above the highest earlier label it
+    collides with, and each layer is one PatchCollection just under its texts.
+    Must be called once the axes layout is final, since box sizes are
+    converted from display to data coordinates.
+    """
+    if not labels:
+        return
+    fig = ax.figure
+    # imshow's equal aspect is only applied at draw time; apply it now so transData is final
+    ax.apply_aspect()
+    renderer = fig.canvas.get_renderer()
+    to_data = ax.transData.inverted()
+    boxes = np.array([text.get_window_extent(renderer).padded(pad * fig.dpi / 72).extents
+                      for text, pad, _ in labels])
+    layers = np.zeros(len(labels), dtype=int)
+    for i in range(1, len(labels)):
+        x0, y0, x1, y1 = boxes[i]
+        hit = ((boxes[:i, 0] < x1) & (boxes[:i, 2] > x0) &
+               (boxes[:i, 1] < y1) & (boxes[:i, 3] > y0))
+        if hit.any():
+            layers[i] = layers[:i][hit].max() + 1
+
+    for layer in range(layers.max() + 1):
+        rects = []
+        facecolors = []
+        for i in np.flatnonzero(layers == layer):
+            text, _, alpha = labels[i]
+            # Texts default to zorder 3, above markers and lines; stack layers above that
+            text.set_zorder(3 + layer)
+            (x0, y0), (x1, y1) = to_data.transform(boxes[i].reshape(2, 2))
+            rects.append(patches.Rectangle((x0, y0), x1 - x0, y1 - y0))
+            facecolors.append((0, 0, 0, alpha))
+        # Unclipped like the texts, so boxes follow labels past the image edge
+        ax.add_collection(PatchCollection(rects, facecolors=facecolors, edgecolors='none',
+                                          zorder=2.9 + layer, clip_on=False),
+                          autolim=False)
+
 def annotate_image(fits_file, json_file, output_file):
     print(f"Processing {fits_file}...")
     
@@ -18,11 +89,11 @@ def annotate_image(fits_file, json_file, output_file):
 
     print(f"Loading FITS file: {fits_file}")
     try:
-        hdul = fits.open(fits_file)
-        data = hdul[0].data
-        header = hdul[0].header
-        wcs = WCS(header)
-        hdul.close()
+        # Memory-mapped, lazily loaded HDUs: pixels are only paged in as they are read
+        with fits.open(fits_file, memmap=True, lazy_load_hdus=True) as hdul:
+            data = hdul[0].data
+            header = hdul[0].header
+            wcs = WCS(header)
         
         # Calculate pixel scale (degrees per pixel)
         try:
@@ -47,7 +118,6 @@ def annotate_image(fits_file, json_file, output_file):
         return
 
     print("Plotting image...")
-    fig, ax = plt.subplots(figsize=(20, 15))
     
     # Normalize image for display
     if data.dtype == np.uint8:
@@ -60,17 +130,39 @@ def annotate_image(fits_file, json_file, output_file):
         vmin, vmax = None, None
         
     # FITS data is usually (y, x) or (channel, y, x)
+    if len(data.shape) == 3 and data.shape[0] == 3:
+        img_data = np.transpose(data, (1, 2, 0))
+    else:
+        img_data = data
+    h, w = img_data.shape[:2]
+
+    # Size the figure to the image aspect and let the axes fill it; only labels
+    # running past the image edge extend the saved area (see the end)
+    fig_scale = min(FIGURE_MAX_SIZE[0] / w, FIGURE_MAX_SIZE[1] / h)
+    # Plain Agg-backed Figure: no pyplot state, safe to use from worker processes
+    fig = Figure(figsize=(w * fig_scale, h * fig_scale), dpi=OUTPUT_DPI)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.set_position([0, 0, 1, 1])
+
+    # Decimate to roughly the output resolution; extent keeps the axes in
+    # full-resolution pixel coordinates so the overlays are unaffected
+    step = max(1, min(w // DISPLAY_MAX_WIDTH, h // DISPLAY_MAX_HEIGHT))
+    disp_data = img_data[::step, ::step]
+    extent = [-0.5, w - 0.5, -0.5, h - 0.5]
+
     if len(data.shape) == 2:
-        ax.imshow(data, cmap='gray', origin='lower', vmin=vmin, vmax=vmax)
+        ax.imshow(disp_data, cmap='gray', origin='lower', vmin=vmin, vmax=vmax, extent=extent)
     elif len(data.shape) == 3:
-        if data.shape[0] == 3:
-            img_data = np.transpose(data, (1, 2, 0))
-        else:
-            img_data = data
-        ax.imshow(img_data, origin='lower')
+        ax.imshow(disp_data, origin='lower', extent=extent)
     
     print(f"Overlaying {len(annotations)} annotations...")
     
+    # Markers are grouped by (color, marker) so each style is one scatter call
+    marker_groups = {}
+    circles = []
+    # Label backgrounds are drawn together at the end rather than as a bbox patch per text
+    label_backgrounds = []
     for ann in annotations:
         cx = ann['pixelx']
         cy = ann['pixely']
@@ -93,77 +185,113 @@ def annotate_image(fits_file, json_file, output_file):
             marker = 'x'
             size = 20
 
-        # Plot marker
+        # Queue marker
         if radius > 5:
-            circ = patches.Circle((cx, cy), radius, linewidth=1.5, edgecolor=color, facecolor='none')
-            ax.add_patch(circ)
+            circles.append(patches.Circle((cx, cy), radius, linewidth=1.5, edgecolor=color, facecolor='none'))
         else:
-            ax.scatter(cx, cy, s=size, c=color, marker=marker, edgecolors='none')
+            xs, ys, sizes = marker_groups.setdefault((color, marker), ([], [], []))
+            xs.append(cx)
+            ys.append(cy)
+            sizes.append(size)
             
         # Add label
-        ax.text(cx + 10, cy + 10, name, color=color, fontsize=12, fontweight='bold',
-                bbox=dict(facecolor='black', alpha=0.5, edgecolor='none', pad=2))
+        label = ax.text(cx + 10, cy + 10, name, color=color, fontsize=12, fontweight='bold')
+        label_backgrounds.append((label, 2, 0.5))
+
+    for (color, marker), (xs, ys, sizes) in marker_groups.items():
+        ax.scatter(xs, ys, s=sizes, c=color, marker=marker, edgecolors='none')
+    if circles:
+        ax.add_collection(PatchCollection(circles, match_original=True))
 
     # Draw Constellation Lines
     print("Drawing constellation lines...")
+    # Index annotation names once so star lookups are a dict hit
+    name_index = constellation_data.build_annotation_index(annotations)
+
+    # Resolve every star pattern once into parallel arrays: position and
+    # 3D distance (NaN if unknown), addressed through star_idx
+    star_idx = {}
+    star_x, star_y, star_d = [], [], []
+    for lines in constellation_data.CONSTELLATION_LINES.values():
+        for pat in (pat for pair in lines for pat in pair):
+            if pat in star_idx:
+                continue
+            star = constellation_data.find_star_in_annotations(pat, name_index)
+            if star:
+                star_idx[pat] = len(star_x)
+                star_x.append(star['pixelx'])
+                star_y.append(star['pixely'])
+                star_d.append(constellation_data.STAR_DISTANCES_LY.get(pat) or np.nan)
+    star_x, star_y, star_d = np.array(star_x, dtype=np.float64), np.array(star_y, dtype=np.float64), np.array(star_d, dtype=np.float64)
+
+    # Collect every segment as a pair of star indices so all lines are drawn
+    # with a single LineCollection
+    seg_i1, seg_i2 = [], []
+    segment_colors = []
     for const_name, lines in constellation_data.CONSTELLATION_LINES.items():
-        lines_drawn = 0
+        pairs = [(star_idx[a], star_idx[b]) for a, b in lines if a in star_idx and b in star_idx]
+        if not pairs:
+            continue
+        i1, i2 = np.array(pairs).T
+        x1, y1, x2, y2 = star_x[i1], star_y[i1], star_x[i2], star_y[i2]
+        # Cohen-Sutherland trivial reject: both endpoints beyond the same image edge
+        offscreen = (((x1 < 0) & (x2 < 0)) | ((x1 > w) & (x2 > w)) |
+                     ((y1 < 0) & (y2 < 0)) | ((y1 > h) & (y2 > h)))
+        i1, i2 = i1[~offscreen], i2[~offscreen]
+        if len(i1) == 0:
+            continue
+
         # Get color for this constellation, default to green
         line_color = constellation_data.CONSTELLATION_COLORS.get(const_name, 'lime')
-        
-        for star1_pat, star2_pat in lines:
-            star1 = constellation_data.find_star_in_annotations(star1_pat, annotations)
-            star2 = constellation_data.find_star_in_annotations(star2_pat, annotations)
+        seg_i1.append(i1)
+        seg_i2.append(i2)
+        segment_colors.extend([line_color] * len(i1))
+        print(f"Drawn {len(i1)} lines for {const_name} in {line_color}")
+
+    if seg_i1:
+        I1, I2 = np.concatenate(seg_i1), np.concatenate(seg_i2)
+        P1 = np.column_stack((star_x[I1], star_y[I1]))
+        P2 = np.column_stack((star_x[I2], star_y[I2]))
+        line_collection = LineCollection(np.stack((P1, P2), axis=1).astype(np.float32), colors=segment_colors,
+                                         linewidths=1.5, alpha=0.7, linestyles='-', zorder=2)
+        ax.add_collection(line_collection)
+
+    # Calculate and annotate distances for all segments in one vectorized pass
+    if seg_i1 and deg_per_pixel:
+        mid = (P1 + P2) / 2
+        dist_deg, dist_ly = segment_distances(P1[:, 0], P1[:, 1], P2[:, 0], P2[:, 1],
+                                              star_d[I1], star_d[I2], deg_per_pixel)
+
+        for (mx, my), deg, ly in zip(mid, dist_deg, dist_ly):
+            label_text = f"{deg:.1f}°"
+            if not np.isnan(ly):
+                label_text += f"\n{ly:.0f} ly"
             
-            if star1 and star2:
-                x1, y1 = star1['pixelx'], star1['pixely']
-                x2, y2 = star2['pixelx'], star2['pixely']
-                
-                # Draw line
-                ax.plot([x1, x2], [y1, y2], color=line_color, linewidth=1.5, alpha=0.7, linestyle='-')
-                lines_drawn += 1
-                
-                # Calculate and annotate distance
-                if deg_per_pixel:
-                    dist_px = np.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-                    dist_deg = dist_px * deg_per_pixel
-                    
-                    # Midpoint
-                    mx, my = (x1 + x2) / 2, (y1 + y2) / 2
-                    
-                    # Check if we have 3D distances for both stars
-                    d1 = constellation_data.STAR_DISTANCES_LY.get(star1_pat)
-                    d2 = constellation_data.STAR_DISTANCES_LY.get(star2_pat)
-                    
-                    label_text = f"{dist_deg:.1f}°"
-                    
-                    if d1 and d2:
-                        # Law of Cosines: c^2 = a^2 + b^2 - 2ab cos(C)
-                        # C is the angular separation in radians
-                        theta_rad = np.radians(dist_deg)
-                        dist_ly = np.sqrt(d1**2 + d2**2 - 2*d1*d2*np.cos(theta_rad))
-                        label_text += f"\n{dist_ly:.0f} ly"
-                    
-                    # Annotate distance
-                    ax.text(mx, my, label_text, color='white', fontsize=9, 
-                            ha='center', va='center',
-                            bbox=dict(facecolor='black', alpha=0.6, edgecolor='none', pad=1))
-        
-        if lines_drawn > 0:
-            print(f"Drawn {lines_drawn} lines for {const_name} in {line_color}")
+            # Annotate distance
+            label = ax.text(mx, my, label_text, color='white', fontsize=9, 
+                            ha='center', va='center')
+            label_backgrounds.append((label, 1, 0.6))
 
     ax.axis('off')
-    plt.tight_layout()
-    plt.savefig(output_file, dpi=150, bbox_inches='tight')
-    plt.close()
+    add_label_backgrounds(ax, label_backgrounds)
+    # Equivalent of bbox_inches='tight' (default 0.1 in pad), measured once from
+    # the laid-out artists instead of by an extra draw, so labels overhanging
+    # the image are kept whole
+    tight = fig.get_tightbbox(fig.canvas.get_renderer()).padded(0.1)
+    fig.savefig(output_file, bbox_inches=tight)
     print(f"Saved annotated image to {output_file}")
 
 def main():
-    # Process Refined Image
-    annotate_image('refined_image_new.fits', 'refined_image_annotations.json', 'annotated_refined_image.png')
-    
-    # Process Original Image
-    annotate_image('IMG_1085_new.fits', 'IMG_1085_annotations.json', 'annotated_original_image.png')
+    jobs = [
+        # Refined Image
+        ('refined_image_new.fits', 'refined_image_annotations.json', 'annotated_refined_image.png'),
+        # Original Image
+        ('IMG_1085_new.fits', 'IMG_1085_annotations.json', 'annotated_original_image.png'),
+    ]
+
+    # The images are independent and rendering is CPU-bound, so annotate them in parallel
+    with ProcessPoolExecutor(max_workers=len(jobs)) as ex:
+        list(ex.map(annotate_image, *zip(*jobs)))
 
 
 if __name__ == "__main__":
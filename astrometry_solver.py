@@ -1,21 +1,37 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 import rawpy
-import imageio.v3 as imageio
 import numpy as np
+from PIL import Image
 from config import API_KEY
 
+# Astrometry.net works on a downsampled image anyway, so larger uploads only cost bandwidth
+UPLOAD_MAX_SIZE = 3000
+
+# Polling backoff: first check after POLL_INITIAL_DELAY seconds, growing by
+# POLL_BACKOFF each round up to POLL_MAX_DELAY
+POLL_INITIAL_DELAY = 0.5
+POLL_BACKOFF = 1.7
+POLL_MAX_DELAY = 30.0
+
 class AstrometrySolver:
     def __init__(self, api_key):
         self.api_key = api_key
         self.base_url = "http://nova.astrometry.net/api"
         self.session = None
+        # One pooled HTTP session so polling reuses the same keep-alive connection
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
 
     def login(self):
         print("Logging in to Astrometry.net...")
-        response = requests.post(f"{self.base_url}/login", data={'request-json': json.dumps({"apikey": self.api_key})})
+        response = self.http.post(f"{self.base_url}/login", data={'request-json': json.dumps({"apikey": self.api_key})})
         result = response.json()
         if result.get('status') == 'success':
             self.session = result.get('session')
@@ -36,7 +52,7 @@ class AstrometrySolver:
             files = {'file': f}
             data = {'request-json': json.dumps(json_data)}
             
-            response = requests.post(f"{self.base_url}/upload", files=files, data=data)
+            response = self.http.post(f"{self.base_url}/upload", files=files, data=data)
             
         result = response.json()
         if result.get('status') == 'success':
@@ -46,11 +62,26 @@ class AstrometrySolver:
         else:
             raise Exception(f"Upload failed: {result}")
 
+    def _poll_json(self, url, cache):
+        # Conditional GET: once the server has sent an ETag, unchanged
+        # resources come back as an empty 304 and the cached result is reused
+        headers = {}
+        if cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        response = self.http.get(url, headers=headers)
+        if response.status_code == 304:
+            return cache['result']
+        result = response.json()
+        cache['etag'] = response.headers.get('ETag')
+        cache['result'] = result
+        return result
+
     def wait_for_submission(self, sub_id):
         print(f"Waiting for submission {sub_id} to process...")
+        delay = POLL_INITIAL_DELAY
+        cache = {}
         while True:
-            response = requests.get(f"{self.base_url}/submissions/{sub_id}")
-            result = response.json()
+            result = self._poll_json(f"{self.base_url}/submissions/{sub_id}", cache)
             
             if result.get('processing_finished'):
                 job_ids = result.get('jobs', [])
@@ -63,13 +94,15 @@ class AstrometrySolver:
                     print(f"Full response: {json.dumps(result, indent=2)}")
                     return []
             
-            time.sleep(2)
+            time.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
 
     def wait_for_job(self, job_id):
         print(f"Waiting for job {job_id} to finish...")
+        delay = POLL_INITIAL_DELAY
+        cache = {}
         while True:
-            response = requests.get(f"{self.base_url}/jobs/{job_id}")
-            result = response.json()
+            result = self._poll_json(f"{self.base_url}/jobs/{job_id}", cache)
             
             status = result.get('status')
             if status == 'success':
@@ -79,18 +112,19 @@ class AstrometrySolver:
                 print(f"Job {job_id} failed.")
                 return False
             
-            time.sleep(2)
+            time.sleep(delay)
+            delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
 
     def get_job_info(self, job_id):
         # Get calibration info
-        response = requests.get(f"{self.base_url}/jobs/{job_id}/calibration")
+        response = self.http.get(f"{self.base_url}/jobs/{job_id}/calibration")
         if response.status_code == 200:
             return response.json()
         return None
     
     def get_annotations(self, job_id):
         # Get annotations (constellations, stars, etc.)
-        response = requests.get(f"{self.base_url}/jobs/{job_id}/annotations")
+        response = self.http.get(f"{self.base_url}/jobs/{job_id}/annotations")
         if response.status_code == 200:
             return response.json()
         return None
@@ -98,10 +132,46 @@ class AstrometrySolver:
 def convert_raw_to_jpg(raw_path, output_path):
     print(f"Converting {raw_path} to {output_path} for upload...")
     with rawpy.imread(raw_path) as raw:
-        rgb = raw.postprocess()
-        # Resize if too large to save bandwidth/time? 
-        # For now, let's just save as is, maybe with some compression
-        imageio.imwrite(output_path, rgb, quality=85)
+        # Half-size demosaic skips interpolation and quarters the pixel count
+        rgb = raw.postprocess(half_size=True, output_bps=8)
+    im = Image.fromarray(rgb)
+    im.thumbnail((UPLOAD_MAX_SIZE, UPLOAD_MAX_SIZE), Image.LANCZOS)
+    im.save(output_path, 'JPEG', quality=80, optimize=True, progressive=True)
+
+def solve_one(solver, img_path):
+    """Upload one image, wait for it to solve and save its calibration. Returns the calibration or None."""
+    print(f"\n--- Solving {img_path} ---")
+    try:
+        sub_id = solver.upload_image(img_path)
+        job_ids = solver.wait_for_submission(sub_id)
+        
+        if not job_ids:
+            print("No jobs generated.")
+            return None
+            
+        # Just track the first job
+        job_id = job_ids[0]
+        success = solver.wait_for_job(job_id)
+        
+        if success:
+            calib = solver.get_job_info(job_id)
+            print(f"Calibration Data for {img_path}:")
+            print(json.dumps(calib, indent=2))
+            
+            # You can also fetch annotations
+            # annotations = solver.get_annotations(job_id)
+            # print(json.dumps(annotations, indent=2))
+            
+            # Save calibration to file
+            base_name = os.path.splitext(img_path)[0]
+            with open(f'{base_name}_calibration.json', 'w') as f:
+                json.dump(calib, f, indent=2)
+            print(f"Saved calibration to {base_name}_calibration.json")
+            return calib
+            
+    except Exception as e:
+        print(f"An error occurred processing {img_path}: {e}")
+    return None
 
 def main():
     if API_KEY == 'YOUR_API_KEY_HERE':
@@ -124,38 +194,17 @@ def main():
         return
 
     images_to_solve = [jpg_image, refined_image]
-    
-    for img_path in images_to_solve:
-        print(f"\n--- Solving {img_path} ---")
-        try:
-            sub_id = solver.upload_image(img_path)
-            job_ids = solver.wait_for_submission(sub_id)
-            
-            if not job_ids:
-                print("No jobs generated.")
-                continue
-                
-            # Just track the first job
-            job_id = job_ids[0]
-            success = solver.wait_for_job(job_id)
-            
-            if success:
-                calib = solver.get_job_info(job_id)
-                print(f"Calibration Data for {img_path}:")
-                print(json.dumps(calib, indent=2))
-                
-                # You can also fetch annotations
-                # annotations = solver.get_annotations(job_id)
-                # print(json.dumps(annotations, indent=2))
-                
-                # Save calibration to file
-                base_name = os.path.splitext(img_path)[0]
-                with open(f'{base_name}_calibration.json', 'w') as f:
-                    json.dump(calib, f, indent=2)
-                print(f"Saved calibration to {base_name}_calibration.json")
-                
-        except Exception as e:
-            print(f"An error occurred processing {img_path}: {e}")
+
+    # Log in once up front so the worker threads share the same session
+    try:
+        solver.login()
+    except Exception as e:
+        print(f"An error occurred logging in: {e}")
+        return
+
+    # Each submission spends most of its time waiting on the server, so solve them concurrently
+    with ThreadPoolExecutor(max_workers=len(images_to_solve)) as ex:
+        list(ex.map(lambda img_path: solve_one(solver, img_path), images_to_solve))
 
 if __name__ == "__main__":
     main()
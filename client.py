@@ -10,6 +10,8 @@ import sys
 import time
 import base64
 import shutil
+import functools
+import logging
 import http.cookiejar
 
 try:
@@ -30,6 +32,9 @@ from email.mime.application  import MIMEApplication
 
 from email.encoders import encode_noop
 
+from urllib3.fields import RequestField
+from urllib3.filepost import choose_boundary
+
 import json
 def json2python(data):
     try:
@@ -37,7 +42,18 @@ def json2python(data):
     except:
         pass
     return None
-python2json = json.dumps
+# Compact separators keep the request payload small
+python2json = functools.partial(json.dumps, separators=(',', ':'))
+
+@functools.lru_cache(maxsize=64)
+def encode_form_json(json):
+    '''
+    x-www-form-urlencoded body for a request-json payload; cached since
+    status polling resends identical payloads
+    '''
+    return urlencode({'request-json': json}).encode('utf-8')
+
+log = logging.getLogger(__name__)
 
 class MalformedResponse(Exception):
     pass
@@ -59,69 +75,78 @@ class Client(object):
         '''
         service: string
         args: dict
+        file_args: optional (filename, open binary file) tuple; the file
+                   is streamed in chunks rather than read into memory
         '''
         if self.session is not None:
             args.update({ 'session' : self.session })
-        print('Python:', args)
+        log.debug('Python: %s', args)
         json = python2json(args)
-        print('Sending json:', json)
+        log.debug('Sending json: %s', json)
         url = self.get_url(service)
-        print('Sending to URL:', url)
+        log.debug('Sending to URL: %s', url)
 
         # If we're sending a file, format a multipart/form-data
         if file_args is not None:
-            import random
-            boundary_key = ''.join([random.choice('0123456789') for i in range(19)])
-            boundary = '===============%s==' % boundary_key
+            # urllib3 renders the part headers; the file body itself is
+            # streamed below rather than encoded into one buffer
+            boundary = choose_boundary()
             headers = {'Content-Type':
-                       'multipart/form-data; boundary="%s"' % boundary}
+                       'multipart/form-data; boundary=%s' % boundary}
+            json_field = RequestField('request-json', json)
+            json_field.make_multipart(content_type='text/plain')
+            file_field = RequestField('file', None, filename=file_args[0])
+            file_field.make_multipart(content_type='application/octet-stream')
             data_pre = (
-                '--' + boundary + '\n' +
-                'Content-Type: text/plain\r\n' +
-                'MIME-Version: 1.0\r\n' +
-                'Content-disposition: form-data; name="request-json"\r\n' +
-                '\r\n' +
-                json + '\n' +
-                '--' + boundary + '\n' +
-                'Content-Type: application/octet-stream\r\n' +
-                'MIME-Version: 1.0\r\n' +
-                'Content-disposition: form-data; name="file"; filename="%s"' % file_args[0] +
-                '\r\n' +
-                '\r\n')
-            data_post = (
-                '\n' + '--' + boundary + '--\n')
-            data = data_pre.encode() + file_args[1] + data_post.encode()
+                '--%s\r\n' % boundary +
+                json_field.render_headers() +
+                json + '\r\n' +
+                '--%s\r\n' % boundary +
+                file_field.render_headers()).encode()
+            data_post = ('\r\n--%s--\r\n' % boundary).encode()
+            fileobj = file_args[1]
+            file_size = os.fstat(fileobj.fileno()).st_size - fileobj.tell()
+            headers['Content-Length'] = str(len(data_pre) + file_size + len(data_post))
+
+            def stream_body(chunk_size=1 << 16):
+                yield data_pre
+                while True:
+                    chunk = fileobj.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                yield data_post
+            data = stream_body()
 
         else:
             # Else send x-www-form-encoded
-            data = {'request-json': json}
-            print('Sending form data:', data)
-            data = urlencode(data)
-            data = data.encode('utf-8')
-            print('Sending data:', data)
+            data = encode_form_json(json)
+            log.debug('Sending data: %s', data)
             headers = {}
 
         request = Request(url=url, headers=headers, data=data)
 
         try:
             f = urlopen(request)
-            print('Got reply HTTP status code:', f.status)
-            print('Got headers:', f.headers)
+            log.debug('Got reply HTTP status code: %s', f.status)
+            log.debug('Got headers: %s', f.headers)
             txt = f.read()
-            print('Got json:', txt)
+            log.debug('Got json: %s', txt)
             result = json2python(txt)
-            print('Got result:', result)
+            log.debug('Got result: %s', result)
             stat = result.get('status')
-            print('Got status:', stat)
+            log.debug('Got status: %s', stat)
             if stat == 'error':
                 errstr = result.get('errormessage', '(none)')
                 raise RequestError('server error message: ' + errstr)
             return result
         except HTTPError as e:
-            print('HTTPError', e)
-            txt = e.read()
-            open('err.html', 'wb').write(txt)
-            print('Wrote error text to err.html')
+            log.error('HTTPError %s', e)
+            if log.isEnabledFor(logging.DEBUG):
+                txt = e.read()
+                with open('err.html', 'wb') as errf:
+                    errf.write(txt)
+                log.debug('Wrote error text to err.html')
 
     def login(self, apikey):
         args = { 'apikey' : apikey }
@@ -176,15 +201,15 @@ class Client(object):
 
     def upload(self, fn=None, **kwargs):
         args = self._get_upload_args(**kwargs)
-        file_args = None
-        if fn is not None:
-            try:
-                f = open(fn, 'rb')
-                file_args = (fn, f.read())
-            except IOError:
-                print('File %s does not exist' % fn)
-                raise
-        return self.send_request('upload', args, file_args)
+        if fn is None:
+            return self.send_request('upload', args)
+        try:
+            f = open(fn, 'rb')
+        except IOError:
+            print('File %s does not exist' % fn)
+            raise
+        with f:
+            return self.send_request('upload', args, (fn, f))
 
     def submission_images(self, subid):
         result = self.send_request('submission_images', {'subid':subid})
@@ -423,6 +448,7 @@ def run_client(opt):
 
 if __name__ == '__main__':
     from config import API_KEY
+    logging.basicConfig(level=logging.INFO)
     
     # Example usage for refined image
     print("Running Astrometry.net client for refined_image.png...")
@@ -1,6 +1,9 @@
 # Constellation lines defined by pairs of star names (Bayer designation or common name)
 # We will try to match these against the names returned by Astrometry.net
 
+import functools
+import itertools
+
 CONSTELLATION_COLORS = {
     'Ori': 'lime',      # Orion - Green
     'Lep': 'cyan',      # Lepus - Cyan
@@ -134,44 +137,56 @@ GREEK_MAP = {
     '\u03c9': 'Omega',
 }
 
+# Greek letters are single codepoints, so one str.translate pass replaces them all
+_GREEK_TABLE = str.maketrans(GREEK_MAP)
+
+@functools.lru_cache(maxsize=4096)
 def normalize_name(name):
     """
     Normalize a star name from Astrometry.net to a standard format (e.g., 'Alpha Ori').
     Input examples: '\u03b1 Ori', 'Betelgeuse', '58 Ori'
     """
-    # Replace Greek letters
-    for greek, english in GREEK_MAP.items():
-        name = name.replace(greek, english)
-    
-    # Remove extra spaces
-    name = ' '.join(name.split())
-    
-    return name
+    # Replace Greek letters, then remove extra spaces
+    return ' '.join(name.translate(_GREEK_TABLE).split())
 
-def find_star_in_annotations(star_name_pattern, annotations):
+def build_annotation_index(annotations):
     """
-    Find a star in the annotations list that matches the pattern.
-    star_name_pattern: e.g., 'Alpha Ori'
+    Index annotations by every normalized name, built once per image.
     annotations: list of dicts from Astrometry.net
+    Returns (aliases, names, found): names keeps every (normalized name,
+    annotation) pair in order; names like "Alpha Ori / 58 Ori" are split on
+    '/' and aliases maps each alias to the position in names of the first name
+    carrying it; found caches lookups per pattern.
     """
-    # We want to match if 'Alpha Ori' is in the list of names for the star
-    # The annotation names might be ["Alpha Ori / 58 Ori", "Betelgeuse"]
-    
-    target_parts = star_name_pattern.split()
-    
+    aliases = {}
+    names = []
     for star in annotations:
-        names = star.get('names', [])
-        for name in names:
+        for name in star.get('names', []):
             norm_name = normalize_name(name)
-            
-            # Check for exact match of the pattern (e.g. "Alpha Ori")
-            # or if the pattern is a substring (e.g. "Alpha Ori" in "Alpha Ori / ...")
-            
-            # Simple check: if the target pattern appears in the normalized name
-            if star_name_pattern in norm_name:
-                return star
-            
-            # Also check for Flamsteed numbers if provided (e.g. "58 Ori")
-            # But our patterns are mostly Bayer.
-            
-    return None
+            for alias in norm_name.split('/'):
+                aliases.setdefault(alias.strip(), len(names))
+            names.append((norm_name, star))
+    return aliases, names, {}
+
+def find_star_in_annotations(star_name_pattern, index):
+    """
+    Find a star whose normalized name contains the pattern.
+    star_name_pattern: e.g., 'Alpha Ori'
+    index: result of build_annotation_index (a raw annotations list is also
+           accepted, but is indexed on every call)
+    Same result as testing the pattern against every name in order, e.g.
+    'Delta Ori' in 'Delta Ori A / 34 Ori A': the earliest name containing it
+    wins. An exact alias bounds that substring scan to the names before it,
+    and each pattern is only resolved once per index.
+    """
+    if isinstance(index, list):
+        index = build_annotation_index(index)
+    aliases, names, found = index
+    if star_name_pattern not in found:
+        limit = aliases.get(star_name_pattern, len(names))
+        earlier = itertools.islice(names, limit)
+        star = next((star for norm_name, star in earlier if star_name_pattern in norm_name), None)
+        if star is None and limit < len(names):
+            star = names[limit][1]
+        found[star_name_pattern] = star
+    return found[star_name_pattern]
@@ -0,0 +1,93 @@
+# DBSCAN for 2D star centroids using a uniform grid instead of a search tree
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Half of the 3x3 cell stencil; the other half is covered by symmetry
+_HALF_STENCIL = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+def _neighbor_pairs(xs, ys, eps):
+    """
+    Index pairs (i, j) with i != j and distance <= eps, each pair listed once
+    in one direction. Points are bucketed into eps-sized cells, so only
+    neighboring cells have to be checked.
+    """
+    n = len(xs)
+    cx = np.floor((xs - xs.min()) / eps).astype(np.int64)
+    cy = np.floor((ys - ys.min()) / eps).astype(np.int64)
+    # One spare row/column on each side so neighbor keys never wrap around
+    ny = cy.max() + 3
+    keys = (cx + 1) * ny + (cy + 1)
+    order = np.argsort(keys, kind='stable')
+    # Work on cell-sorted copies so each cell is a contiguous run
+    sorted_keys = keys[order]
+    sx = xs[order]
+    sy = ys[order]
+
+    eps2 = eps * eps
+    all_src, all_dst = [], []
+    for dx, dy in _HALF_STENCIL:
+        cell = sorted_keys + dx * ny + dy
+        if dx == 0 and dy == 0:
+            # Within a cell only take later points, so each pair appears once
+            lo = np.arange(n) + 1
+        else:
+            lo = np.searchsorted(sorted_keys, cell, 'left')
+        hi = np.searchsorted(sorted_keys, cell, 'right')
+        counts = hi - lo
+        total = counts.sum()
+        if total <= 0:
+            continue
+        src = np.repeat(np.arange(n), counts)
+        # Position of each candidate within its cell's run of sorted points
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        dst = np.repeat(lo, counts) + offsets
+        d2 = (sx[src] - sx[dst]) ** 2 + (sy[src] - sy[dst]) ** 2
+        keep = d2 <= eps2
+        all_src.append(order[src[keep]])
+        all_dst.append(order[dst[keep]])
+    if not all_src:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(all_src), np.concatenate(all_dst)
+
+def grid_dbscan(xs, ys, eps, min_samples):
+    """
+    DBSCAN clustering of 2D points, following sklearn.cluster.DBSCAN semantics:
+    a point is core if at least min_samples points (itself included) lie
+    within eps, clusters are numbered in order of their first core point,
+    and noise is labelled -1.
+    Returns an int array of labels.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    labels = np.full(n, -1, dtype=np.intp)
+    if n == 0:
+        return labels
+
+    src, dst = _neighbor_pairs(xs, ys, eps)
+    # Each pair counts for both ends; +1 for the point itself
+    n_neighbors = np.bincount(src, minlength=n) + np.bincount(dst, minlength=n) + 1
+    core = n_neighbors >= min_samples
+    if not core.any():
+        return labels
+
+    # Clusters are the connected components of core points
+    linked = core[src] & core[dst]
+    graph = coo_matrix((np.ones(linked.sum(), dtype=np.int8), (src[linked], dst[linked])), shape=(n, n))
+    _, component = connected_components(graph, directed=False)
+
+    core_idx = np.flatnonzero(core)
+    comps, first = np.unique(component[core_idx], return_index=True)
+    cluster_of = np.empty(component.max() + 1, dtype=np.intp)
+    cluster_of[comps[np.argsort(first)]] = np.arange(len(comps))
+    labels[core_idx] = cluster_of[component[core_idx]]
+
+    # Border points join the earliest cluster among their core neighbors
+    claim = np.full(n, n, dtype=np.intp)
+    for a, b in ((src, dst), (dst, src)):
+        border = core[b] & ~core[a]
+        np.minimum.at(claim, a[border], labels[b[border]])
+    is_border = claim < n
+    labels[is_border] = claim[is_border]
+    return labels
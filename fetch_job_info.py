@@ -1,5 +1,7 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+from concurrent.futures import ThreadPoolExecutor
 from config import API_KEY
 
 JOB_ID = '14931481'
@@ -7,21 +9,21 @@ JOB_ID = '14931481'
 def get_job_info(job_id):
     print(f"Fetching info for job {job_id}...")
     
-    # Get tags
-    response = requests.get(f'http://nova.astrometry.net/api/jobs/{job_id}/tags')
-    print("Tags:", response.json())
+    base_url = f'http://nova.astrometry.net/api/jobs/{job_id}'
+    endpoints = {
+        "Tags": f'{base_url}/tags',
+        "Machine Tags": f'{base_url}/machine_tags',
+        "Objects in field": f'{base_url}/objects_in_field',
+        "Calibration": f'{base_url}/calibration',
+    }
     
-    # Get machine tags
-    response = requests.get(f'http://nova.astrometry.net/api/jobs/{job_id}/machine_tags')
-    print("Machine Tags:", response.json())
-    
-    # Get objects in field
-    response = requests.get(f'http://nova.astrometry.net/api/jobs/{job_id}/objects_in_field')
-    print("Objects in field:", response.json())
-    
-    # Get calibration
-    response = requests.get(f'http://nova.astrometry.net/api/jobs/{job_id}/calibration')
-    print("Calibration:", response.json())
+    # The endpoints are independent, so fetch them concurrently over one pooled session
+    with requests.Session() as session:
+        session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=len(endpoints)))
+        with ThreadPoolExecutor(max_workers=len(endpoints)) as ex:
+            futures = {name: ex.submit(session.get, url) for name, url in endpoints.items()}
+            for name, future in futures.items():
+                print(f"{name}:", future.result().json())
 
 if __name__ == "__main__":
     get_job_info(JOB_ID)
@@ -0,0 +1,36 @@
+# Grayscale conversion and sky statistics for 8-bit RGB frames from rawpy
+import numpy as np
+from astropy.stats import sigma_clipped_stats
+
+# Equal weights reproduce np.mean(rgb, axis=2), which detection thresholds were tuned on
+MEAN_WEIGHTS = (1.0 / 3.0, 1.0 / 3.0, 1.0 / 3.0)
+# Rec. 709 luminosity weights
+LUMA_WEIGHTS = (0.2126, 0.7152, 0.0722)
+
+# Sky statistics are estimated on every STATS_SAMPLE_STRIDE-th pixel (~1%).
+# A prime stride is coprime with the image width, so the sample walks across
+# every column; a stride of 100 on a 4020-px-wide frame only ever hits every
+# 20th column.
+STATS_SAMPLE_STRIDE = 101
+
+def rgb_to_gray_f32(rgb, weights=MEAN_WEIGHTS, out=None):
+    """
+    Weighted grayscale of an (H, W, 3) image as float32.
+    Channels are accumulated straight into the float32 output, so no
+    (H, W, 3) float64 temporary is created the way np.mean(rgb, axis=2) does.
+    """
+    if out is None:
+        out = np.empty(rgb.shape[:2], dtype=np.float32)
+    tmp = np.empty_like(out)
+    np.multiply(rgb[..., 0], np.float32(weights[0]), out=out)
+    for c in (1, 2):
+        np.multiply(rgb[..., c], np.float32(weights[c]), out=tmp)
+        out += tmp
+    return out
+
+def sky_stats(img, sigma=3.0):
+    """
+    sigma_clipped_stats (mean, median, std) of img, estimated on a strided
+    ~1% pixel sample instead of the full frame.
+    """
+    return sigma_clipped_stats(img.reshape(-1)[::STATS_SAMPLE_STRIDE], sigma=sigma)
@@ -1,33 +1,53 @@
-import rawpy
+from raw_cache import load_rgb_cached
 import numpy as np
 from photutils.detection import DAOStarFinder
-from astropy.stats import sigma_clipped_stats
 import matplotlib.pyplot as plt
-from sklearn.cluster import DBSCAN
+from fast_dbscan import grid_dbscan
+from grayscale import rgb_to_gray_f32, sky_stats
+
+# Spectral sampled once at its native 256 entries; cluster colors index into it
+_PALETTE = plt.cm.Spectral(np.linspace(0, 1, 256))
+
+def clear_overlays(ax):
+    """Remove scatter overlays and the legend from ax, keeping its background image."""
+    for collection in list(ax.collections):
+        collection.remove()
+    legend = ax.get_legend()
+    if legend is not None:
+        legend.remove()
 
 def main():
     image_path = 'IMG_1085.CR2'
     
     print(f"Loading image: {image_path}")
     try:
-        with rawpy.imread(image_path) as raw:
-            rgb = raw.postprocess()
+        rgb = load_rgb_cached(image_path)
     except Exception as e:
         print(f"Error loading image: {e}")
         return
 
     # Convert to grayscale
-    # Simple average or luminosity method
-    gray = np.mean(rgb, axis=2)
+    # Simple average (pass grayscale.LUMA_WEIGHTS for the luminosity method)
+    gray = rgb_to_gray_f32(rgb)
     
     print("Calculating statistics...")
-    mean, median, std = sigma_clipped_stats(gray, sigma=3.0)
+    mean, median, std = sky_stats(gray, sigma=3.0)
     print(f"Mean: {mean:.2f}, Median: {median:.2f}, Std: {std:.2f}")
 
     print("Detecting stars with varying FWHM...")
     
     results = []
     
+    # Figures are created once and reused for every FWHM; the gray background
+    # is drawn once per figure and only the overlays change between iterations
+    display = dict(cmap='gray', origin='lower', vmin=mean-std, vmax=mean+5*std)
+    fig_det, ax_det = plt.subplots(figsize=(20, 20))
+    ax_det.imshow(gray, **display)
+    fig_stats, axes_stats = plt.subplots(2, 2, figsize=(15, 10))
+    ax_mag, ax_flux, ax_peak, ax_shape = axes_stats.flat
+    fig_clu, ax_clu = plt.subplots(figsize=(20, 20))
+    ax_clu.imshow(gray, **display)
+    
     # Iterate FWHM from 1 to 10
     for fwhm in range(4, 5):
         print(f"Processing FWHM = {fwhm}...")
@@ -35,96 +55,107 @@ def main():
         sources = daofind(gray - median)
         
         count = len(sources) if sources is not None else 0
-        results.append((fwhm, sources))
+        # The combined plot only needs centroids; keep those and drop the table
+        if sources is not None:
+            xs = np.asarray(sources['xcentroid'], dtype=np.float32)
+            ys = np.asarray(sources['ycentroid'], dtype=np.float32)
+        else:
+            xs = ys = np.empty(0, dtype=np.float32)
+        results.append((fwhm, xs, ys, count))
         
         # Plot individual detection
-        plt.figure(figsize=(20, 20))
-        plt.imshow(gray, cmap='gray', origin='lower', vmin=mean-std, vmax=mean+5*std)
+        clear_overlays(ax_det)
         if sources is not None:
-            plt.scatter(sources['xcentroid'], sources['ycentroid'], s=5, edgecolor='red', facecolor='none', label='Stars')
-        plt.title(f"FWHM: {fwhm}, Detected {count} Stars")
-        plt.legend()
-        plt.savefig(f'star_detection_fwhm_{fwhm}.png')
-        plt.close()
+            ax_det.scatter(sources['xcentroid'], sources['ycentroid'], s=5, edgecolor='red', facecolor='none', label='Stars')
+        ax_det.set_title(f"FWHM: {fwhm}, Detected {count} Stars")
+        ax_det.legend()
+        fig_det.savefig(f'star_detection_fwhm_{fwhm}.png')
         print(f"Saved star_detection_fwhm_{fwhm}.png")
 
         if sources is not None:
             # Plotting statistics
-            plt.figure(figsize=(15, 10))
+            for ax in axes_stats.flat:
+                ax.clear()
 
             # Magnitude Histogram
-            plt.subplot(2, 2, 1)
-            plt.hist(sources['mag'], bins=30, color='skyblue', edgecolor='black')
-            plt.title(f'Star Magnitude Distribution (FWHM={fwhm})')
-            plt.xlabel('Magnitude')
-            plt.ylabel('Count')
+            ax_mag.hist(sources['mag'], bins=30, color='skyblue', edgecolor='black')
+            ax_mag.set_title(f'Star Magnitude Distribution (FWHM={fwhm})')
+            ax_mag.set_xlabel('Magnitude')
+            ax_mag.set_ylabel('Count')
 
             # Flux Histogram
-            plt.subplot(2, 2, 2)
-            plt.hist(sources['flux'], bins=30, color='lightgreen', edgecolor='black')
-            plt.title(f'Star Flux Distribution (FWHM={fwhm})')
-            plt.xlabel('Flux')
-            plt.ylabel('Count')
+            ax_flux.hist(sources['flux'], bins=30, color='lightgreen', edgecolor='black')
+            ax_flux.set_title(f'Star Flux Distribution (FWHM={fwhm})')
+            ax_flux.set_xlabel('Flux')
+            ax_flux.set_ylabel('Count')
             
             # Peak vs Flux
-            plt.subplot(2, 2, 3)
-            plt.scatter(sources['flux'], sources['peak'], alpha=0.5, s=10)
-            plt.title(f'Peak Value vs Flux (FWHM={fwhm})')
-            plt.xlabel('Flux')
-            plt.ylabel('Peak Value')
+            ax_peak.scatter(sources['flux'], sources['peak'], alpha=0.5, s=10)
+            ax_peak.set_title(f'Peak Value vs Flux (FWHM={fwhm})')
+            ax_peak.set_xlabel('Flux')
+            ax_peak.set_ylabel('Peak Value')
 
             # Roundness vs Sharpness (if available)
-            if 'sharpness' in sources.colnames and 'roundness1' in sources.colnames:
-                plt.subplot(2, 2, 4)
-                plt.scatter(sources['sharpness'], sources['roundness1'], alpha=0.5, s=10)
-                plt.title(f'Sharpness vs Roundness (FWHM={fwhm})')
-                plt.xlabel('Sharpness')
-                plt.ylabel('Roundness')
+            has_shape = 'sharpness' in sources.colnames and 'roundness1' in sources.colnames
+            ax_shape.set_visible(has_shape)
+            if has_shape:
+                ax_shape.scatter(sources['sharpness'], sources['roundness1'], alpha=0.5, s=10)
+                ax_shape.set_title(f'Sharpness vs Roundness (FWHM={fwhm})')
+                ax_shape.set_xlabel('Sharpness')
+                ax_shape.set_ylabel('Roundness')
 
-            plt.tight_layout()
-            plt.savefig(f'star_statistics_fwhm_{fwhm}.png')
-            plt.close()
+            fig_stats.tight_layout()
+            fig_stats.savefig(f'star_statistics_fwhm_{fwhm}.png')
             print(f"Saved star_statistics_fwhm_{fwhm}.png")
 
             # DBSCAN Clustering
-            coords = np.transpose((sources['xcentroid'], sources['ycentroid']))
+            # Full-precision centroids, so eps comparisons match the float64 table values
+            cx = np.asarray(sources['xcentroid'])
+            cy = np.asarray(sources['ycentroid'])
             # eps=100 pixels, min_samples=5 stars to form a cluster
-            db = DBSCAN(eps=35, min_samples=12).fit(coords)
-            labels = db.labels_
-            n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
+            labels = grid_dbscan(cx, cy, eps=35, min_samples=12)
             
-            plt.figure(figsize=(20, 20))
-            plt.imshow(gray, cmap='gray', origin='lower', vmin=mean-std, vmax=mean+5*std)
+            # Group points by label with one stable sort, so each label is a contiguous run
+            order = np.argsort(labels, kind='stable')
+            sorted_labels = labels[order]
+            sorted_cx, sorted_cy = cx[order], cy[order]
+            starts = np.flatnonzero(np.diff(sorted_labels, prepend=sorted_labels[0] - 1))
+            ends = np.append(starts[1:], len(sorted_labels))
+            run_labels = sorted_labels[starts]
+            n_clusters_ = int(np.count_nonzero(run_labels != -1))
+            
+            clear_overlays(ax_clu)
             
             # Plot noise
-            noise_mask = labels == -1
-            plt.scatter(coords[noise_mask, 0], coords[noise_mask, 1], s=5, c='gray', alpha=0.5, label='Noise')
+            n_noise = ends[0] if run_labels[0] == -1 else 0
+            ax_clu.scatter(sorted_cx[:n_noise], sorted_cy[:n_noise], s=5, c='gray', alpha=0.5, label='Noise')
             
-            # Plot clusters
-            unique_labels = set(labels)
-            colors = plt.cm.Spectral(np.linspace(0, 1, len(unique_labels)))
-            for k, col in zip(unique_labels, colors):
+            # Plot clusters; cluster k takes the k-th color of the palette
+            # (same bins as plt.cm.Spectral(np.linspace(0, 1, len(run_labels))))
+            colors = _PALETTE[np.minimum(np.linspace(0, 1, len(run_labels)) * len(_PALETTE), len(_PALETTE) - 1).astype(int)]
+            for k, start, end in zip(run_labels, starts, ends):
                 if k == -1:
                     continue
-                class_member_mask = (labels == k)
-                plt.scatter(coords[class_member_mask, 0], coords[class_member_mask, 1], s=20, color=col, label=f'Cluster {k}')
+                ax_clu.scatter(sorted_cx[start:end], sorted_cy[start:end], s=20, color=colors[k], label=f'Cluster {k}')
             
-            plt.title(f"FWHM: {fwhm}, Clusters: {n_clusters_}")
-            plt.savefig(f'star_clusters_fwhm_{fwhm}.png')
-            plt.close()
+            ax_clu.set_title(f"FWHM: {fwhm}, Clusters: {n_clusters_}")
+            fig_clu.savefig(f'star_clusters_fwhm_{fwhm}.png')
             print(f"Saved star_clusters_fwhm_{fwhm}.png")
 
+    for fig in (fig_det, fig_stats, fig_clu):
+        plt.close(fig)
+
     # Combined plot of detections
     print("Creating combined plot...")
     fig, axes = plt.subplots(2, 5, figsize=(25, 10))
     axes = axes.flatten()
     
-    for idx, (fwhm, sources) in enumerate(results):
+    for idx, (fwhm, xs, ys, count) in enumerate(results):
         ax = axes[idx]
         ax.imshow(gray, cmap='gray', origin='lower', vmin=mean-std, vmax=mean+5*std)
-        if sources is not None:
-            ax.scatter(sources['xcentroid'], sources['ycentroid'], s=1, edgecolor='red', facecolor='none')
-        ax.set_title(f"FWHM: {fwhm}, Stars: {len(sources) if sources is not None else 0}")
+        if count:
+            ax.scatter(xs, ys, s=1, edgecolor='red', facecolor='none')
+        ax.set_title(f"FWHM: {fwhm}, Stars: {count}")
         ax.axis('off')
         
     plt.tight_layout()
@@ -0,0 +1,46 @@
+# Disk cache for demosaiced RAW frames and other per-image arrays, so re-runs
+# skip the libraw decode and the expensive derived maps
+import os
+import tempfile
+
+import numpy as np
+import rawpy
+
+CACHE_DIR = '.cache'
+
+def cached_array(path, tag, compute, cache_dir=CACHE_DIR):
+    """
+    Return compute(), memory-mapped from a .npy cache derived from the file at path.
+    The cache key is the file name, mtime and size plus tag, so editing or
+    replacing the file invalidates it. tag should name the computation and
+    any parameters that change its result.
+    """
+    st = os.stat(path)
+    name = f"{os.path.basename(path)}.{st.st_mtime_ns}.{st.st_size}.{tag}.npy"
+    cache = os.path.join(cache_dir, name)
+    if os.path.exists(cache):
+        return np.load(cache, mmap_mode='r')
+
+    arr = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write under a unique temporary name so an interrupted run never leaves a
+    # truncated cache and concurrent runs never write into the same file
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, arr)
+        os.replace(tmp, cache)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return arr
+
+def _postprocess(path):
+    with rawpy.imread(path) as raw:
+        return raw.postprocess()
+
+def load_rgb_cached(path, cache_dir=CACHE_DIR):
+    """
+    Return raw.postprocess() of a RAW file, memory-mapped from a .npy cache.
+    """
+    return cached_array(path, 'rgb', lambda: _postprocess(path), cache_dir)
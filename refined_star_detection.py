@@ -1,56 +1,109 @@
-import rawpy
+from raw_cache import cached_array, load_rgb_cached
 import numpy as np
 import matplotlib.pyplot as plt
 from photutils.background import Background2D, MedianBackground
 from photutils.detection import DAOStarFinder
-from astropy.stats import SigmaClip, sigma_clipped_stats
-from skimage.restoration import denoise_wavelet
+from astropy.stats import SigmaClip
 import imageio.v3 as imageio
+from grayscale import MEAN_WEIGHTS, rgb_to_gray_f32, sky_stats
+from wavelet_denoise import parallel_denoise_wavelet
+
+# Grayscale weights and Background2D settings; together they name the cached
+# background map, so any change to them computes a fresh one
+GRAY_WEIGHTS = MEAN_WEIGHTS
+BKG_BOX_SIZE = (50, 50)
+BKG_FILTER_SIZE = (3, 3)
+BKG_CLIP_SIGMA = 3.0
+
+def normalize_gamma_u8(img, vmin, vmax, gamma_inv):
+    """
+    Scale img to [0, 1] between vmin and vmax, clip, gamma-correct and
+    quantize to uint8. All steps run in place on one float32 buffer instead
+    of allocating a full-size temporary per step.
+    """
+    work = np.subtract(img, vmin, dtype=np.float32)
+    work *= np.float32(1.0 / (vmax - vmin))
+    np.clip(work, 0, 1, out=work)
+    np.power(work, np.float32(gamma_inv), out=work)
+    work *= 255
+    return work.astype(np.uint8)
+
+def percentiles(img, qs):
+    """
+    Linear-interpolated percentiles (same as np.percentile) from a single
+    np.partition pass over one flattened copy, instead of a full sort per q.
+    Falls back to np.nanpercentile if the image contains NaNs.
+    """
+    flat = img.ravel()
+    if not np.isfinite(flat).all():
+        return [np.nanpercentile(flat, q) for q in qs]
+    pos = [q / 100.0 * (flat.size - 1) for q in qs]
+    kth = sorted({int(np.floor(p)) for p in pos} | {int(np.ceil(p)) for p in pos})
+    part = np.partition(flat, kth)
+    out = []
+    for p in pos:
+        lo, hi = int(np.floor(p)), int(np.ceil(p))
+        out.append(part[lo] + (part[hi] - part[lo]) * (p - lo))
+    return out
 
 def main():
     image_path = 'IMG_1085.CR2'
     print(f"Loading image: {image_path}")
     
     try:
-        with rawpy.imread(image_path) as raw:
-            # postprocess() yields an 8-bit RGB image by default
-            rgb = raw.postprocess()
+        # postprocess() yields an 8-bit RGB image by default; cached after the first run
+        rgb = load_rgb_cached(image_path)
     except Exception as e:
         print(f"Error loading image: {e}")
         return
 
     # Convert to grayscale (0-255 range)
     print("Converting to grayscale...")
-    gray = np.mean(rgb, axis=2)
+    gray = rgb_to_gray_f32(rgb, GRAY_WEIGHTS)
     
     # 1. Background Subtraction
-    print("Estimating background (this may take a moment)...")
     # Sigma clipping to ignore stars when estimating background
-    sigma_clip = SigmaClip(sigma=3.0)
+    sigma_clip = SigmaClip(sigma=BKG_CLIP_SIGMA)
     bkg_estimator = MedianBackground()
     
     # Box size: size of the box to estimate background in. 
     # Needs to be larger than the stars but smaller than large scale variations.
     # For a high res image, 50x50 or 100x100 is reasonable.
-    bkg = Background2D(gray, (50, 50), filter_size=(3, 3),
-                       sigma_clip=sigma_clip, bkg_estimator=bkg_estimator)
+    def estimate_background():
+        print("Estimating background (this may take a moment)...")
+        bkg = Background2D(gray, BKG_BOX_SIZE, filter_size=BKG_FILTER_SIZE,
+                           sigma_clip=sigma_clip, bkg_estimator=bkg_estimator)
+        return bkg.background.astype(np.float32)
+    
+    # The background map depends on the RAW file, the grayscale weights and the
+    # Background2D settings above; it is cached next to the decoded frame
+    # under a tag built from all of them
+    bkg_tag = (f"bkg.gray{'-'.join(f'{w:.6g}' for w in GRAY_WEIGHTS)}"
+               f".box{BKG_BOX_SIZE[0]}x{BKG_BOX_SIZE[1]}"
+               f".filt{BKG_FILTER_SIZE[0]}x{BKG_FILTER_SIZE[1]}"
+               f".clip{BKG_CLIP_SIGMA:g}.{type(bkg_estimator).__name__}")
+    background = cached_array(image_path, bkg_tag, estimate_background)
     
     print("Subtracting background...")
-    gray_bkg_sub = gray - bkg.background
+    # Keep everything float32: DAOStarFinder and the 8-bit export don't need
+    # more precision, and it halves the memory traffic of every later pass.
+    # The raw gray image isn't used again, so subtract in place.
+    np.subtract(gray, background, out=gray)
+    gray_bkg_sub = gray
     
     # 2. Denoising (Wavelet)
     print("Denoising (Wavelet) - this is computationally intensive...")
     # Wavelet denoising is effective for preserving features while removing noise
     # We pass the background subtracted image. 
-    # skimage often converts to float [0, 1], so we handle that.
-    gray_denoised = denoise_wavelet(gray_bkg_sub, channel_axis=None, rescale_sigma=True)
+    # Same result as skimage's denoise_wavelet, computed in tiles across all cores.
+    gray_denoised = parallel_denoise_wavelet(gray_bkg_sub)
     
     # Check range of denoised image to ensure compatibility
     print(f"Denoised image range: {gray_denoised.min():.4f} to {gray_denoised.max():.4f}")
     
     # 3. Star Detection
     print("Calculating statistics on refined image...")
-    mean, median, std = sigma_clipped_stats(gray_denoised, sigma=3.0)
+    mean, median, std = sky_stats(gray_denoised, sigma=3.0)
     print(f"Refined Image - Mean: {mean:.6f}, Median: {median:.6f}, Std: {std:.6f}")
     
     print("Detecting stars...")
@@ -66,7 +119,12 @@ def main():
         print(f"Found {len(sources)} stars.")
         
         # Save results
-        sources.write('refined_stars_found.csv', format='csv', overwrite=True)
+        # Only the columns used downstream, written by np.savetxt rather than
+        # astropy's per-cell ASCII writer
+        csv_cols = ('xcentroid', 'ycentroid', 'flux', 'peak', 'mag')
+        np.savetxt('refined_stars_found.csv',
+                   np.column_stack([np.asarray(sources[c]) for c in csv_cols]),
+                   delimiter=',', header=','.join(csv_cols), fmt='%.4f', comments='')
         
         # Plotting
         plt.figure(figsize=(20, 20))
@@ -84,18 +142,12 @@ def main():
     # Robust scaling using percentiles to handle hot pixels/artifacts
     # Clip background at 1st percentile (keep it dark but not necessarily 0)
     # Clip highlights at 99.9th percentile (stars)
-    vmin = np.nanpercentile(gray_denoised, 1)
-    vmax = np.nanpercentile(gray_denoised, 99.9)
+    vmin, vmax = percentiles(gray_denoised, (1, 99.9))
     
     print(f"Scaling image with vmin={vmin:.2f}, vmax={vmax:.2f}")
     
-    refined_norm = (gray_denoised - vmin) / (vmax - vmin)
-    refined_norm = np.clip(refined_norm, 0, 1)
-    
-    # Apply a slight gamma correction to bring out fainter stars
-    refined_norm = np.power(refined_norm, 1.0/2.2)
-    
-    refined_uint8 = (refined_norm * 255).astype(np.uint8)
+    # Normalize, then apply a slight gamma correction to bring out fainter stars
+    refined_uint8 = normalize_gamma_u8(gray_denoised, vmin, vmax, 1.0/2.2)
     
     imageio.imwrite('refined_image.png', refined_uint8)
     print("Refined image saved to refined_image.png")